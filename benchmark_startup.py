@@ -0,0 +1,207 @@
+# coding: utf-8
+
+"""
+Measure the startup cost of the FortiCare tools and guard it over time.
+
+Each case runs a command that exits before any API call (help, option errors,
+missing .forticare file) and checks that no heavy dependency has been imported
+on the way (modules already imported by a bare interpreter, through .pth files
+for instance, are ignored). With --budget, the median run time above a bare
+interpreter must also stay within the given number of milliseconds.
+
+Exit code is 1 if any check fails, so that it can run in a CI job.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Global
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must only be imported by the code paths that need them
+heavy_modules = (
+    "requests",
+    "urllib3",
+    "chardet",
+    "idna",
+    "certifi",
+    "PyPDF2",
+    "zipfile",
+    "concurrent.futures",
+)
+
+cases = (
+    ("help", ["--help"]),
+    ("register --help", ["register", "--help"]),
+    ("register option error", ["register"]),
+    ("register without .forticare", ["register", "-c", "C6G36-V7TT7-DAE15-4EZ8T"]),
+    ("license --help", ["license", "--help"]),
+    ("license option error", ["license"]),
+    ("csv --help", ["csv", "--help"]),
+    ("queue --help", ["queue", "--help"]),
+    ("watch --help", ["watch", "--help"]),
+)
+
+
+def get_command(pyz, args):
+    """
+    Return the command line running the tools.
+
+    Parameters
+    ----------
+        pyz: str
+            the zipapp to benchmark, None to run the package of this folder.
+        args: list
+            the command arguments.
+
+    Returns
+    -------
+        command: list
+            the command line.
+    """
+    if pyz:
+        return [sys.executable, os.path.abspath(pyz)] + args
+    return [sys.executable, "-m", "forticare"] + args
+
+
+def get_imported_modules(command, cwd, env):
+    """
+    Return the modules imported by a command, as reported by -X importtime.
+
+    Parameters
+    ----------
+        command: list
+            the command line, starting with the python interpreter.
+        cwd: str
+            the working directory.
+        env: dict
+            the environment.
+
+    Returns
+    -------
+        modules: set
+            the imported module names.
+    """
+    r = subprocess.run(
+        command[:1] + ["-X", "importtime"] + command[1:],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    modules = set()
+    for line in r.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def get_run_time(command, cwd, env, runs):
+    """
+    Return the median run time of a command.
+
+    Parameters
+    ----------
+        command: list
+            the command line.
+        cwd: str
+            the working directory.
+        env: dict
+            the environment.
+        runs: int
+            the number of runs.
+
+    Returns
+    -------
+        run_time: float
+            the median run time in milliseconds.
+    """
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def parse_command_line_arguments():
+    """
+    Commande line management with an argparse instance.
+
+    Returns
+    -------
+        args: Namespace
+            the parsed arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        "--runs",
+        dest="runs",
+        type=int,
+        default=10,
+        help="Number of runs per case (default: 10)",
+    )
+    parser.add_argument(
+        "-b",
+        "--budget",
+        dest="budget",
+        type=float,
+        default=None,
+        help="Maximum startup overhead in milliseconds over a bare interpreter",
+    )
+    parser.add_argument(
+        "--pyz",
+        dest="pyz",
+        default=None,
+        help="Benchmark a zipapp built by build-zipapp.sh instead of the package",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_command_line_arguments()
+
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    failed = False
+
+    # Run from an empty folder so that no .forticare file is found
+    with tempfile.TemporaryDirectory() as cwd:
+        bare = [sys.executable, "-c", "pass"]
+        baseline = get_run_time(bare, cwd, env, args.runs)
+        preloaded = get_imported_modules(bare, cwd, env)
+        print("{:32}{:8.1f} ms".format("python3 -c pass", baseline))
+
+        for name, case_args in cases:
+            command = get_command(args.pyz, case_args)
+            modules = get_imported_modules(command, cwd, env) - preloaded
+            heavy = sorted(set(heavy_modules) & modules)
+            run_time = get_run_time(command, cwd, env, args.runs)
+            overhead = run_time - baseline
+
+            status = "ok"
+            if heavy:
+                status = "FAILED, imports " + ", ".join(heavy)
+            elif args.budget is not None and overhead > args.budget:
+                status = "FAILED, over budget"
+            failed = failed or status != "ok"
+
+            print(
+                "{:32}{:8.1f} ms (+{:.1f} ms) {}".format(
+                    name, run_time, overhead, status
+                )
+            )
+
+    sys.exit(1 if failed else 0)
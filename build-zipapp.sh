@@ -0,0 +1,34 @@
+#! /bin/bash
+#
+# Build a single executable file bundling all the tools, for instance:
+#   ./forticare.pyz register -c <REGISTRATIONCODE> --lic
+#
+# The dependencies (requests, PyPDF2) are not bundled, they must be installed
+# in the python3 environment running the zipapp.
+
+usage() {
+    echo "$0 [ -o <OUTPUT.pyz> ]"
+    exit 0
+}
+
+output=forticare.pyz
+
+while getopts "ho:" arg; do
+    case $arg in
+    o)
+        output=${OPTARG}
+        ;;
+    h)
+        usage
+        ;;
+    esac
+done
+
+build=$(mktemp -d)
+trap 'rm -rf "${build}"' EXIT
+
+cp -r "$(dirname "$0")/forticare" "${build}/"
+find "${build}" -name __pycache__ -prune -exec rm -rf {} +
+
+python3 -m zipapp "${build}" -m "forticare.cli:main" -p "/usr/bin/env python3" -o "${output}" || exit 1
+echo "${output} built."
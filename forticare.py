@@ -1,11 +0,0 @@
-# coding: utf-8
-"""
-Class FortiCare API v3
-"""
-
-class forticare:
-    pass
-
-if __name__ == "__main__":
-    print("Hello World!")    
-
@@ -0,0 +1,14 @@
+# coding: utf-8
+"""
+FortiCare registration tools.
+
+The tools are run as sub-commands of the package (python3 -m forticare, or the
+forticare.pyz zipapp), see forticare.cli. Heavy dependencies (requests,
+PyPDF2) are only imported by the code paths that use them.
+"""
+
+
+class forticare:
+    """Class FortiCare API v3"""
+
+    pass
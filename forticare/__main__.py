@@ -0,0 +1,7 @@
+# coding: utf-8
+
+"""Run the FortiCare tools with python3 -m forticare."""
+
+from forticare.cli import main
+
+main()
@@ -0,0 +1,93 @@
+# coding: utf-8
+
+"""
+Single entry point of the FortiCare tools.
+
+Each sub-command is a module of the package, imported only once the
+sub-command is known so that "--help" and option errors stay fast.
+"""
+
+import importlib
+import os
+import sys
+
+# Global
+commands = {
+    "register": ("forticare.register", "Register a product entitlement or license."),
+    "license": ("forticare.license", "Retrieve or synchronize license files."),
+    "csv": (
+        "forticare.generate_csv",
+        "Generate a registration CSV file from an order ZIP file.",
+    ),
+    "queue": (
+        "forticare.jobqueue",
+        "Run registrations and downloads from a shared job queue.",
+    ),
+    "watch": (
+        "forticare.watch",
+        "Queue the registrations of the order ZIP files landing in a folder.",
+    ),
+}
+
+
+def get_base_prog():
+    """
+    Return the program name of the package entry point.
+
+    Returns
+    -------
+        prog: str
+            "forticare" when run with python3 -m, the script name otherwise.
+    """
+    prog = os.path.basename(sys.argv[0])
+    return "forticare" if prog in ("__main__.py", "-c", "") else prog
+
+
+def usage(prog):
+    """
+    Return the usage message listing the sub-commands.
+
+    Parameters
+    ----------
+        prog: str
+            the program name.
+
+    Returns
+    -------
+        usage: str
+            the usage message.
+    """
+    lines = ["usage: {} COMMAND [ OPTIONS ]".format(prog), "", "commands:"]
+    for command, (module, description) in commands.items():
+        lines.append("  {:10}{}".format(command, description))
+    lines.append("")
+    lines.append('Run "{} COMMAND --help" for the options of a command.'.format(prog))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Run the sub-command given on the command line.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    prog = get_base_prog()
+
+    if argv and argv[0] in ("-h", "--help"):
+        print(usage(prog))
+        sys.exit(0)
+
+    if not argv or argv[0] not in commands:
+        print(usage(prog), file=sys.stderr)
+        if argv:
+            print("\n{}: unknown command {}".format(prog, argv[0]), file=sys.stderr)
+        sys.exit(2)
+
+    module = importlib.import_module(commands[argv[0]][0])
+    module.main(argv[1:], prog="{} {}".format(prog, argv[0]))
@@ -0,0 +1,599 @@
+# coding: utf-8
+
+"""
+Persistent job queue for registrations and license downloads.
+
+Jobs are stored in a directory shared by every worker (local disk for a single
+host, NFS or any shared filesystem for several hosts). Each job is a JSON file
+moving between the following sub-directories with atomic renames:
+
+    pending/   jobs waiting for a worker
+    leased/    jobs claimed by a worker, the lease expires when the file has
+               not been touched for --lease seconds
+    done/      jobs that succeeded
+    failed/    jobs that failed --attempts times
+
+Workers run the "register" and "license" commands in a sub-process, as
+register.sh does, so several workers on several hosts simply share the load.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+from forticare import register
+from forticare.utils import get_prog, init_logging
+
+# Global
+logger = logging.getLogger(__name__)
+# the folder (or zipapp) holding the forticare package, given to sub-processes
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+states = ("pending", "leased", "done", "failed")
+
+
+class FileStore:
+    """
+    File-backed job store.
+
+    Every state change is an os.rename() within the store directory, which is
+    atomic on a local filesystem and on NFS, so that a job can only be claimed
+    by a single worker. A claimed job is renamed "leased/<job_id>.<token>.json"
+    where the token is unique to the claim: a worker whose lease expired and
+    whose job has been claimed again can't complete it a second time.
+
+    A job file is only rewritten after it has been renamed to a name known by
+    its owner alone (".claiming" or ".releasing" suffix).
+    """
+
+    def __init__(self, path, lease=300.0):
+        self.path = path
+        self.lease = lease
+        for state in states:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _file(self, state, name):
+        """Return the path of the file "name" in the sub-directory "state"."""
+        return os.path.join(self.path, state, name)
+
+    def put(self, job, job_id=None):
+        """
+        Add a job to the queue.
+
+        Parameters
+        ----------
+            job: dict
+                the job, with at least a "type" key.
+            job_id: str
+                the job identifier, in the "<time_ns>-<hex>" format. The job is
+                not added if a job with this identifier exists in any state,
+                so that putting it again is harmless. None for a new identifier.
+
+        Returns
+        -------
+            job_id: str
+                the identifier of the queued job.
+        """
+        if job_id is None:
+            # ids are sorted by creation time so that jobs are claimed in FIFO
+            # order, starting from a random job for each worker (list_pending())
+            job_id = "{:020d}-{}".format(time.time_ns(), uuid.uuid4().hex[:8])
+        elif self.exists(job_id):
+            logger.debug("Job %s already queued." % job_id)
+            return job_id
+
+        job = dict(job, id=job_id, attempts=0)
+        tmp = self._file("pending", "." + job_id + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.rename(tmp, self._file("pending", job_id + ".json"))
+        return job_id
+
+    def exists(self, job_id):
+        """
+        Return whether a job is in the store, whatever its state.
+
+        Parameters
+        ----------
+            job_id: str
+                the job identifier.
+
+        Returns
+        -------
+            exists: bool
+                True if the job is pending, leased, done or failed.
+        """
+        for state in ("pending", "done", "failed"):
+            if os.path.exists(self._file(state, job_id + ".json")):
+                return True
+        # leases are named "<job_id>.<token>.json"
+        return any(
+            name.startswith(job_id + ".")
+            for name in os.listdir(os.path.join(self.path, "leased"))
+        )
+
+    def list_pending(self):
+        """
+        List the pending jobs.
+
+        Returns
+        -------
+            names: list
+                the pending job files, in FIFO order from a random job so that
+                the workers don't all race for the oldest one.
+        """
+        names = sorted(
+            name
+            for name in os.listdir(os.path.join(self.path, "pending"))
+            if name.endswith(".json") and not name.startswith(".")
+        )
+        offset = random.randrange(len(names)) if names else 0
+        return names[offset:] + names[:offset]
+
+    def claim(self, worker, pending=None):
+        """
+        Claim a pending job.
+
+        Parameters
+        ----------
+            worker: str
+                the worker name, recorded in the job for troubleshooting.
+            pending: deque
+                the pending jobs listed by the previous claims of the worker,
+                tried first and listed again once exhausted, so that the
+                directory is not listed at each claim. None to always list it.
+
+        Returns
+        -------
+            (lease, job): (str, dict)
+                the lease file and the claimed job.
+            None:
+                None if there is no pending job.
+        """
+        if pending is None:
+            pending = deque()
+        listed = False
+        while True:
+            if not pending:
+                if listed:
+                    return None
+                pending.extend(self.list_pending())
+                listed = True
+                continue
+
+            name = pending.popleft()
+            job_id = name[: -len(".json")]
+            lease = self._file("leased", "{}.{}".format(job_id, uuid.uuid4().hex))
+            try:
+                # The lease starts now, not when the job was queued
+                os.utime(self._file("pending", name))
+                os.rename(self._file("pending", name), lease + ".claiming")
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+
+            with open(lease + ".claiming", "r+") as f:
+                job = json.load(f)
+                job["attempts"] += 1
+                job["worker"] = worker
+                f.seek(0)
+                f.truncate()
+                json.dump(job, f)
+            os.rename(lease + ".claiming", lease + ".json")
+            return lease + ".json", job
+
+    def renew(self, lease):
+        """
+        Extend a lease.
+
+        Parameters
+        ----------
+            lease: str
+                the lease file as returned by claim().
+
+        Returns
+        -------
+            renewed: bool
+                False if the lease has expired and the job has been re-queued.
+        """
+        try:
+            os.utime(lease)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, lease, job, state):
+        """
+        Move a leased job to the state "state".
+
+        Parameters
+        ----------
+            lease: str
+                the lease file as returned by claim().
+            job: dict
+                the job, written back with its new content.
+            state: str
+                one of "pending", "done" or "failed".
+
+        Returns
+        -------
+            released: bool
+                False if the lease had expired, the job then belongs to another
+                worker.
+        """
+        releasing = lease[: -len(".json")] + ".releasing"
+        try:
+            os.rename(lease, releasing)
+        except FileNotFoundError:
+            return False
+
+        with open(releasing, "w") as f:
+            json.dump(job, f)
+        os.rename(releasing, self._file(state, job["id"] + ".json"))
+        return True
+
+    def requeue_expired(self):
+        """
+        Move back to "pending" the jobs whose lease has expired.
+
+        Returns
+        -------
+            count: int
+                the number of re-queued jobs.
+        """
+        count = 0
+        now = time.time()
+        for name in os.listdir(os.path.join(self.path, "leased")):
+            # also recover the jobs of a worker that died during a claim/release
+            lease = self._file("leased", name)
+            try:
+                if now - os.stat(lease).st_mtime < self.lease:
+                    continue
+                job_id = name.split(".", 1)[0]
+                os.rename(lease, self._file("pending", job_id + ".json"))
+            except FileNotFoundError:
+                # Completed or re-queued by another worker in the meantime
+                continue
+            logger.warning("Lease of job %s expired, job re-queued." % job_id)
+            count += 1
+        return count
+
+    def counts(self):
+        """
+        Return the progress counters of the queue.
+
+        Returns
+        -------
+            counts: dict
+                the number of jobs per state.
+        """
+        return {
+            state: sum(
+                1
+                for name in os.listdir(os.path.join(self.path, state))
+                if name.endswith(".json") and not name.startswith(".")
+            )
+            for state in states
+        }
+
+
+def job_command(job):
+    """
+    Return the command line running a job.
+
+    Parameters
+    ----------
+        job: dict
+            a "register" or "download" job.
+
+    Returns
+    -------
+        command: list
+            the command line arguments.
+    """
+    if job["type"] == "register":
+        command = [
+            sys.executable,
+            "-m",
+            "forticare",
+            "register",
+            "--code",
+            job["code"],
+            "--description",
+            job["desc"],
+            "--address",
+            job["ip"],
+            "--serial",
+            job["sn"],
+        ]
+        if job.get("lic"):
+            command.append("--lic")
+    elif job["type"] == "download":
+        command = [
+            sys.executable,
+            "-m",
+            "forticare",
+            "license",
+            "--serial",
+            job["sn"],
+        ]
+    else:
+        raise ValueError("Unknown job type: {}".format(job["type"]))
+
+    return command
+
+
+def run_job(store, lease, job):
+    """
+    Run a job while keeping its lease alive.
+
+    Parameters
+    ----------
+        store: FileStore
+            the job store.
+        lease: str
+            the lease file as returned by claim().
+        job: dict
+            the job to run.
+
+    Returns
+    -------
+        success: bool
+            whether the job succeeded.
+    """
+    pythonpath = [package_root]
+    if os.environ.get("PYTHONPATH"):
+        pythonpath.append(os.environ["PYTHONPATH"])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+    process = subprocess.Popen(job_command(job), env=env)
+    renewed = True
+    while True:
+        try:
+            process.wait(timeout=store.lease / 3)
+            break
+        except subprocess.TimeoutExpired:
+            if renewed and not store.renew(lease):
+                logger.warning("Lease of job %s lost." % job["id"])
+                renewed = False
+
+    return process.returncode == 0
+
+
+def work(store, worker, max_attempts, wait):
+    """
+    Claim and run jobs until the queue is empty.
+
+    Parameters
+    ----------
+        store: FileStore
+            the job store.
+        worker: str
+            the worker name.
+        max_attempts: int
+            the number of attempts before a job is moved to "failed".
+        wait: float
+            if not None, poll the queue every "wait" seconds instead of
+            returning when it is empty.
+    """
+    pending = deque()
+    requeued_at = None
+    while True:
+        # A lease lasts store.lease seconds, no need to look for the expired
+        # ones at each claim
+        now = time.monotonic()
+        if requeued_at is None or now - requeued_at >= store.lease / 3:
+            store.requeue_expired()
+            requeued_at = now
+
+        claimed = store.claim(worker, pending)
+
+        if claimed is None:
+            counts = store.counts()
+            if wait is None and counts["leased"] == 0 and counts["pending"] == 0:
+                return
+            # Poll often enough to pick up the jobs re-queued by other workers
+            time.sleep(min(wait or 1.0, store.lease / 3))
+            continue
+
+        lease, job = claimed
+        logger.info(
+            "Running %s job %s (attempt %d)" % (job["type"], job["id"], job["attempts"])
+        )
+        if run_job(store, lease, job):
+            state = "done"
+        elif job["attempts"] < max_attempts:
+            state = "pending"
+        else:
+            state = "failed"
+
+        if not store.release(lease, job, state):
+            logger.warning("Job %s was re-queued while running." % job["id"])
+        else:
+            logger.info("Job %s is %s." % (job["id"], state))
+
+
+def read_registrations(file, lic):
+    """
+    Read registration jobs from a CSV file in the register.sh format.
+
+    Parameters
+    ----------
+        file: str
+            the CSV file (<code>,<ip>,<description>[,<serial>]).
+        lic: bool
+            whether the license file must be saved during the registration.
+
+    Returns
+    -------
+        jobs: generator
+            the "register" jobs.
+    """
+    for registration in register.read_registrations([file], lic):
+        yield {
+            "type": "register",
+            "code": registration.code,
+            "ip": registration.ip,
+            "desc": registration.desc,
+            "sn": registration.sn,
+            "lic": registration.lic,
+        }
+
+
+def parse_command_line_arguments(argv=None, prog=None):
+    """
+    Commande line management with an argparse instance.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+
+    Returns
+    -------
+        args: Namespace
+            the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog=get_prog(prog))
+    parser.add_argument(
+        "-q",
+        "--queue",
+        dest="queue",
+        required=True,
+        help="Indicate the queue directory (shared by all the workers)",
+    )
+    parser.add_argument(
+        "--lease",
+        dest="lease",
+        type=float,
+        default=300.0,
+        help="Lease duration in seconds (default: 300)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        default=False,
+        help="Verbose output",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = subparsers.add_parser("enqueue", help="Add jobs to the queue")
+    enqueue.add_argument(
+        "-f",
+        "--file",
+        dest="files",
+        action="append",
+        default=[],
+        help="Register the codes of a CSV file (can be repeated)",
+    )
+    enqueue.add_argument(
+        "-l",
+        "--lic",
+        dest="lic",
+        action="store_true",
+        default=False,
+        help="Retrieve the license files during the registrations",
+    )
+    enqueue.add_argument(
+        "-s",
+        "--serial",
+        dest="serials",
+        action="append",
+        default=[],
+        help="Download the license of a serial number (can be repeated)",
+    )
+
+    worker = subparsers.add_parser("work", help="Run jobs from the queue")
+    worker.add_argument(
+        "-n",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Number of jobs run in parallel by this host (default: 1)",
+    )
+    worker.add_argument(
+        "--attempts",
+        dest="attempts",
+        type=int,
+        default=3,
+        help="Attempts before a job is marked as failed (default: 3)",
+    )
+    worker.add_argument(
+        "--wait",
+        dest="wait",
+        type=float,
+        default=None,
+        help="Poll the queue every WAIT seconds instead of exiting when empty",
+    )
+
+    subparsers.add_parser("status", help="Show the progress counters")
+    subparsers.add_parser("requeue", help="Re-queue the jobs with an expired lease")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None, prog=None):
+    """
+    Run the "queue" command.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+    """
+    global logger
+
+    logger = init_logging(prog)
+    args = parse_command_line_arguments(argv, prog)
+
+    if args.verbose is False:
+        logger.setLevel(logging.INFO)
+
+    store = FileStore(args.queue, args.lease)
+
+    if args.command == "enqueue":
+        count = 0
+        for file in args.files:
+            for job in read_registrations(file, args.lic):
+                store.put(job)
+                count += 1
+        for sn in args.serials:
+            store.put({"type": "download", "sn": sn})
+            count += 1
+        logger.info("%d job(s) queued." % count)
+    elif args.command == "work":
+        threads = []
+        for i in range(args.workers):
+            worker = "{}-{}-{}".format(socket.gethostname(), os.getpid(), i)
+            threads.append(
+                threading.Thread(
+                    target=work, args=(store, worker, args.attempts, args.wait)
+                )
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elif args.command == "requeue":
+        logger.info("%d job(s) re-queued." % store.requeue_expired())
+
+    counts = store.counts()
+    print(", ".join("{}: {}".format(state, counts[state]) for state in states))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,881 @@
+# coding: utf-8
+
+"""
+Retrieve a license file from a serial number.
+
+With --sync, keep a folder of <SN>.lic files up to date: only the license
+files whose content changed on FortiCare are rewritten.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import deque
+from optparse import OptionParser
+
+from forticare import tracing
+from forticare.utils import check_reply, get_prog, init_logging
+
+# Global
+logger = logging.getLogger(__name__)
+api_url = "https://Support.Fortinet.COM/ES/FCWS_RegistrationService.svc/REST"
+api_token = "<YOUR_FORTICARE_API_TOKEN>"
+
+# Request timeout in seconds, so that a dead service can be detected
+api_timeout = 30.0
+
+# Send a duplicate REST_DownloadLicense request when the first one is slower
+# than this percentile of the recent latencies (None disables hedging)
+hedge_percentile = 95.0
+hedge_min_samples = 10
+# Share of the --sync rate budget reserved for the hedged requests
+hedge_budget = 0.1
+# Threads shared by all the hedged calls, created on demand
+hedge_max_workers = 64
+hedge_pool = None
+hedge_pool_lock = threading.Lock()
+
+
+class CircuitBreakerOpen(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+class LatencyTracker:
+    """Keep the latencies of the last successful API calls."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        """
+        Record the latency of a successful call.
+
+        Parameters
+        ----------
+            latency: float
+                the call duration in seconds.
+        """
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, p, min_samples=1):
+        """
+        Return the p-th percentile of the recorded latencies.
+
+        Parameters
+        ----------
+            p: float
+                the percentile, between 0 and 100.
+            min_samples: int
+                the number of samples required to compute a percentile.
+
+        Returns
+        -------
+            latency: float
+                the percentile in seconds.
+            None:
+                None if there are not enough samples yet.
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if len(samples) < max(min_samples, 1):
+            return None
+
+        index = round(p / 100 * (len(samples) - 1))
+        return samples[min(max(index, 0), len(samples) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Fail fast when the error rate of the API calls crosses a threshold.
+
+    The breaker is "closed" while calls succeed. It opens when the failure rate
+    over the last "window" calls reaches "threshold", rejects calls during
+    "cooldown" seconds, then becomes "half-open" and lets a single probe call
+    through: the breaker closes if it succeeds and opens again otherwise.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=0.5, window=20, min_calls=5, cooldown=30.0):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.results = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return whether a call can be made now.
+
+        Returns
+        -------
+            allowed: bool
+                False if the breaker is open or a probe call is in flight.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                logger.info("Circuit breaker half-open, probing the service.")
+                self.state = self.HALF_OPEN
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, success):
+        """
+        Record the outcome of a call and update the breaker state.
+
+        Parameters
+        ----------
+            success: bool
+                whether the call succeeded.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                if success:
+                    logger.info("Probe succeeded, circuit breaker closed.")
+                    self.state = self.CLOSED
+                    self.results.clear()
+                else:
+                    self._open()
+                return
+
+            self.results.append(success)
+            failures = self.results.count(False)
+            if (
+                self.state == self.CLOSED
+                and len(self.results) >= self.min_calls
+                and failures / len(self.results) >= self.threshold
+            ):
+                self._open()
+
+    def _open(self):
+        """Open the breaker, the caller must hold the lock."""
+        logger.warning(
+            "Circuit breaker open, pausing calls for %.1f seconds." % self.cooldown
+        )
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    def wait(self):
+        """Block while the breaker rejects calls, ie. pause the queue."""
+        while True:
+            with self.lock:
+                if self.state == self.CLOSED:
+                    return
+                if self.state == self.OPEN:
+                    remaining = self.opened_at + self.cooldown - time.monotonic()
+                    if remaining <= 0:
+                        return
+                elif self.probing:
+                    # Another thread is probing, wait for its result
+                    remaining = 0.1
+                else:
+                    return
+            time.sleep(remaining)
+
+
+class RateLimiter:
+    """Space out the API calls so that at most "rate" calls are made per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(self.next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+
+class TokenBucket:
+    """
+    Allow "rate" calls per second on average, with bursts of "burst" calls.
+
+    Unlike RateLimiter, a call is never delayed: it is refused when the bucket
+    is empty.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Take a token if one is available now.
+
+        Returns
+        -------
+            acquired: bool
+                False if the budget is exhausted, the call must not be made.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class DaemonThreadPool:
+    """
+    Thread pool whose threads don't delay the exit of the process.
+
+    A ThreadPoolExecutor joins its threads at exit, ie. waits for the request
+    that lost a hedged call up to api_timeout, while its reply is dropped.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.tasks = queue.Queue()
+        self.threads = 0
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) in a thread of the pool.
+
+        Parameters
+        ----------
+            fn: function
+                the function to run.
+            args: tuple
+                its arguments.
+
+        Returns
+        -------
+            future: Future
+                the future result of the call.
+        """
+        from concurrent.futures import Future
+
+        future = Future()
+        with self.lock:
+            self.tasks.put((future, fn, args))
+            if self.idle == 0 and self.threads < self.max_workers:
+                self.threads += 1
+                threading.Thread(target=self._run, daemon=True).start()
+        return future
+
+    def _run(self):
+        """Run the submitted calls, forever."""
+        while True:
+            with self.lock:
+                self.idle += 1
+            future, fn, args = self.tasks.get()
+            with self.lock:
+                self.idle -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+latencies = LatencyTracker()
+breaker = CircuitBreaker()
+
+
+def build_payload(sn):
+    """
+    Build the JSON payload.
+
+    Parameters
+    ----------
+    sn: str
+        The serial number of the device.
+
+    Returns
+    -------
+    json_payload: dict
+        A JSON dictionnary.
+    """
+    with tracing.span("payload_build", sn=sn):
+        json_payload = {
+            "Token": api_token,
+            "Version": "1.0",
+            "Serial_Number": sn,
+        }
+
+    logger.debug("Payload to post is: %s" % json_payload)
+    return json_payload
+
+
+def retrieve_license(payload, hedges=None):
+    """
+    Retrieve the license file with an API call.
+
+    parameters
+    ----------
+        payload: dict
+            The JSON payload for that is passed to the API call.
+        hedges: TokenBucket
+            the budget of the hedged requests, None for no budget.
+
+    Returns
+    -------
+        license: str
+            The content of the license file.
+    """
+    api_function = "REST_DownloadLicense"
+    url = api_url + "/" + api_function
+
+    if not breaker.allow():
+        raise CircuitBreakerOpen("FortiCare calls are paused by the circuit breaker")
+
+    try:
+        # An error reply (invalid token...) is a failed call too
+        jres = check_reply(post_hedged(url, payload, hedges))
+    except BaseException:
+        # Whatever the error, a probe must not leave the breaker half-open
+        breaker.record(False)
+        raise
+    breaker.record(True)
+
+    logger.debug('Retrieved license information, status code is "%s"' % jres["Message"])
+    return jres["License_File"]
+
+
+def post(url, payload):
+    """
+    Perform a single API call and record its latency.
+
+    Parameters
+    ----------
+        url: str
+            the API url.
+        payload: dict
+            the JSON payload to pass to the call.
+
+    Returns
+    -------
+        jres: dict
+            the content of the API call response in JSON format.
+    """
+    import requests
+
+    start = time.monotonic()
+    with tracing.span("http_call", url=url):
+        r = requests.post(url=url, json=payload, timeout=api_timeout)
+    if r.status_code >= 500:
+        r.raise_for_status()
+    with tracing.span("json_decode"):
+        jres = r.json()
+    latencies.add(time.monotonic() - start)
+    return jres
+
+
+def get_hedge_pool():
+    """
+    Return the thread pool shared by the hedged calls.
+
+    Returns
+    -------
+        pool: DaemonThreadPool
+            the thread pool, created at the first call.
+    """
+    global hedge_pool
+
+    with hedge_pool_lock:
+        if hedge_pool is None:
+            hedge_pool = DaemonThreadPool(hedge_max_workers)
+        return hedge_pool
+
+
+def post_hedged(url, payload, hedges=None):
+    """
+    Perform an idempotent API call, hedged with a duplicate request when slow.
+
+    Once enough latencies have been recorded, a second identical request is
+    sent if the first one did not reply within the "hedge_percentile" latency,
+    and the first successful reply wins. The duplicate request is only sent if
+    the hedge budget has a token available right now.
+
+    Parameters
+    ----------
+        url: str
+            the API url.
+        payload: dict
+            the JSON payload to pass to the call.
+        hedges: TokenBucket
+            the budget of the duplicate requests, None for no budget.
+
+    Returns
+    -------
+        jres: dict
+            the content of the first successful API call response.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    delay = None
+    if hedge_percentile is not None:
+        delay = latencies.percentile(hedge_percentile, hedge_min_samples)
+
+    if delay is None:
+        return post(url, payload)
+
+    pool = get_hedge_pool()
+    futures = {pool.submit(post, url, payload)}
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        if hedges is None or hedges.try_acquire():
+            logger.debug("No reply after %.3fs, sending a hedged request." % delay)
+            futures.add(pool.submit(post, url, payload))
+        else:
+            logger.debug("No reply after %.3fs, no budget left to hedge." % delay)
+
+    # The slower request is not waited for, its reply is simply dropped
+    error = None
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def write_license_file(lic, file):
+    """
+    Write the content of the license to a file.
+
+    Parameters
+    ----------
+        lic: str
+            The content of the license file.
+        file: str
+            The file name.
+
+    Returns
+    -------
+        None.
+    """
+    logger.debug("Creating output file %s" % file)
+    with tracing.span("file_write", file=file):
+        # Written as bytes, so that the file hash is the hash of the license
+        f = open(file, "wb")
+        f.write(lic.encode())
+        f.close()
+
+
+def get_local_licenses(folder):
+    """
+    Return the license files of a folder and their last refresh time.
+
+    Parameters
+    ----------
+        folder: str
+            a folder with <sn>.lic files.
+
+    Returns
+    -------
+        licenses: dict
+            the modification time of the license files, by serial number.
+    """
+    licenses = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            result = re.search(r"(.+)\.lic$", entry.name)
+            if result and entry.is_file():
+                licenses[result.group(1)] = entry.stat().st_mtime
+
+    return licenses
+
+
+def sync_license(sn, file, limiter, hedges=None):
+    """
+    Retrieve a license and rewrite its file only if its content changed.
+
+    Parameters
+    ----------
+        sn: str
+            the serial number.
+        file: str
+            the license file name.
+        limiter: RateLimiter
+            the rate budget shared by the workers.
+        hedges: TokenBucket
+            the budget of the hedged requests shared by the workers.
+
+    Returns
+    -------
+        status: str
+            "new", "changed", "unchanged", "missing" or "failed".
+    """
+    import requests
+
+    my_payload = build_payload(sn)
+    while True:
+        # Pause the queue while the circuit breaker is open
+        breaker.wait()
+        limiter.acquire()
+        try:
+            lic = retrieve_license(my_payload, hedges)
+            break
+        except CircuitBreakerOpen:
+            continue
+        except KeyError:
+            # Successful reply without license file
+            lic = None
+            break
+        except (requests.RequestException, ValueError) as e:
+            # including the error replies (APIError)
+            logger.error("Unable to retrieve the license of %s: %s" % (sn, e))
+            return "failed"
+
+    if not lic:
+        return "missing"
+
+    try:
+        with open(file, "rb") as f:
+            local_hash = hashlib.sha256(f.read()).digest()
+    except FileNotFoundError:
+        write_license_file(lic, file)
+        return "new"
+
+    if local_hash == hashlib.sha256(lic.encode()).digest():
+        # Mark the license as refreshed for the oldest first ordering
+        os.utime(file)
+        return "unchanged"
+
+    write_license_file(lic, file)
+    return "changed"
+
+
+def sync_licenses(folder, serials, workers, rate):
+    """
+    Synchronize a folder of <sn>.lic files with FortiCare.
+
+    The licenses of the folder and the given serial numbers are refreshed in
+    parallel, from the least recently refreshed to the most recently refreshed
+    (serial numbers without license file first).
+
+    Parameters
+    ----------
+        folder: str
+            the folder of <sn>.lic files.
+        serials: list
+            serial numbers to retrieve in addition of the folder ones.
+        workers: int
+            the number of parallel API calls.
+        rate: float
+            the maximum number of API calls per second.
+
+    Returns
+    -------
+        results: dict
+            the serial numbers by status ("new", "changed", "unchanged",
+            "missing" and "failed").
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    local = get_local_licenses(folder)
+    sns = sorted(set(local) | set(serials), key=lambda sn: local.get(sn, 0))
+    logger.info("Synchronizing %d license(s) in %s" % (len(sns), folder))
+
+    hedges = None
+    if hedge_percentile is not None:
+        # A share of the budget is kept for the hedged requests, the workers
+        # keep the main one busy
+        hedge_rate = rate * hedge_budget
+        hedges = TokenBucket(hedge_rate, burst=max(1.0, hedge_rate))
+        rate -= hedge_rate
+    limiter = RateLimiter(rate)
+    results = {
+        status: [] for status in ("new", "changed", "unchanged", "missing", "failed")
+    }
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                sync_license, sn, os.path.join(folder, sn + ".lic"), limiter, hedges
+            ): sn
+            for sn in sns
+        }
+        for future in as_completed(futures):
+            sn = futures[future]
+            status = future.result()
+            logger.debug("License of %s is %s." % (sn, status))
+            results[status].append(sn)
+
+    return results
+
+
+def read_serials(file):
+    """
+    Read serial numbers from a file, one per line.
+
+    Parameters
+    ----------
+        file: str
+            the file name, empty lines and lines starting with "#" are skipped.
+
+    Returns
+    -------
+        serials: list
+            the serial numbers.
+    """
+    with open(file) as f:
+        return [
+            line.strip() for line in f if line.strip() and not line.startswith("#")
+        ]
+
+
+def init_option_parser(argv=None, prog=None):
+    """
+    Initialize an option parser object.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+
+    Returns
+    -------
+        (options,args): tuple
+            A tuple as returned by the optparse module.
+    """
+    usage = (
+        "usage: %prog -s|--serial SERIAL [ -s|--serial SERIAL ... ]"
+        "[ --file FILENAME ] [ -v|--verbose ]\n"
+        "       %prog --sync FOLDER [ --serials FILENAME ] [ -s|--serial SERIAL ... ]"
+        "[ -n|--workers WORKERS ] [ --rate RATE ] [ -v|--verbose ]"
+        "[ --timeout SECONDS ] [ --hedge-percentile PERCENTILE ]"
+        "[ --breaker-threshold RATE ] [ --breaker-cooldown SECONDS ]"
+        "[ --trace FILENAME ] [ --profile FILENAME ]"
+    )
+
+    parser = OptionParser(usage=usage, prog=get_prog(prog))
+
+    parser.add_option(
+        "-f", "--file", dest="file", metavar="FILENAME", help="License output filename."
+    )
+    parser.add_option(
+        "-s",
+        "--serial",
+        dest="sn",
+        action="append",
+        metavar="SERIAL",
+        help=(
+            "Serial number of the unit you want the license for "
+            "(can be repeated to retrieve several licenses)."
+        ),
+    )
+    parser.add_option(
+        "--sync",
+        dest="sync",
+        metavar="FOLDER",
+        help="Refresh the <SERIAL>.lic files of FOLDER whose content changed.",
+    )
+    parser.add_option(
+        "--serials",
+        dest="serials",
+        metavar="FILENAME",
+        help="With --sync, file of serial numbers (one per line) to retrieve too.",
+    )
+    parser.add_option(
+        "-n",
+        "--workers",
+        dest="workers",
+        type="int",
+        default=8,
+        metavar="WORKERS",
+        help="With --sync, number of parallel API calls (default: %default).",
+    )
+    parser.add_option(
+        "--rate",
+        dest="rate",
+        type="float",
+        default=10.0,
+        metavar="RATE",
+        help="With --sync, maximum API calls per second (default: %default).",
+    )
+    parser.add_option(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        default=False,
+        help="Verbose output",
+    )
+    parser.add_option(
+        "--timeout",
+        dest="timeout",
+        type="float",
+        default=api_timeout,
+        metavar="SECONDS",
+        help="API call timeout (default: %default).",
+    )
+    parser.add_option(
+        "--hedge-percentile",
+        dest="hedge_percentile",
+        type="float",
+        default=hedge_percentile,
+        metavar="PERCENTILE",
+        help=(
+            "Send a duplicate request when a call is slower than this latency "
+            "percentile, 0 to disable (default: %default)."
+        ),
+    )
+    parser.add_option(
+        "--breaker-threshold",
+        dest="breaker_threshold",
+        type="float",
+        default=breaker.threshold,
+        metavar="RATE",
+        help=(
+            "Error rate (0-1) over the last calls that pauses the queue "
+            "(default: %default)."
+        ),
+    )
+    parser.add_option(
+        "--breaker-cooldown",
+        dest="breaker_cooldown",
+        type="float",
+        default=breaker.cooldown,
+        metavar="SECONDS",
+        help="Pause before probing the service again (default: %default).",
+    )
+    parser.add_option(
+        "--trace",
+        dest="trace",
+        metavar="FILENAME",
+        help="Write a Chrome trace (JSON) of the run stages to FILENAME.",
+    )
+    parser.add_option(
+        "--profile",
+        dest="profile",
+        metavar="FILENAME",
+        help="Write a cProfile dump of the run to FILENAME.",
+    )
+
+    (options, args) = parser.parse_args(argv)
+
+    if options.sync is not None:
+        if options.file is not None:
+            parser.error("Options --file and --sync are mutually exclusive.")
+        options.sn = options.sn or []
+    elif options.serials is not None:
+        parser.error("Option --serials requires --sync.")
+
+    if options.workers < 1:
+        parser.error("Option --workers must be at least 1.")
+
+    if options.rate <= 0:
+        parser.error("Option --rate must be greater than 0.")
+
+    if options.sn is None:
+        parser.error("Serial number not specified.")
+
+    if options.file is not None and len(options.sn) > 1:
+        parser.error("Option --file can only be used with a single serial number.")
+
+    return (options, args)
+
+
+def main(argv=None, prog=None):
+    """
+    Run the "license" command.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+    """
+    global api_timeout, hedge_percentile, logger
+
+    logger = init_logging(prog)
+    (options, args) = init_option_parser(argv, prog)
+    tracing.start(options.trace, options.profile)
+
+    if options.verbose is False:
+        logger.setLevel(logging.INFO)
+
+    api_timeout = options.timeout
+    hedge_percentile = options.hedge_percentile or None
+    breaker.threshold = options.breaker_threshold
+    breaker.cooldown = options.breaker_cooldown
+
+    if options.sync is not None:
+        serials = options.sn
+        if options.serials is not None:
+            serials += read_serials(options.serials)
+        results = sync_licenses(options.sync, serials, options.workers, options.rate)
+        for sn in results["missing"]:
+            logger.warning("No license available for %s" % sn)
+        print(
+            ", ".join(
+                "{}: {}".format(status, len(sns)) for status, sns in results.items()
+            )
+        )
+        sys.exit(1 if results["failed"] else 0)
+
+    import requests
+
+    failed = 0
+    for sn in options.sn:
+        file = options.file
+        if file is None:
+            file = sn + ".lic"
+
+        # Pause the queue while the circuit breaker is open
+        breaker.wait()
+
+        my_payload = build_payload(sn)
+        try:
+            lic = retrieve_license(my_payload)
+        except (
+            requests.RequestException,
+            ValueError,
+            KeyError,
+            CircuitBreakerOpen,
+        ) as e:
+            logger.error("Unable to retrieve the license of %s: %s" % (sn, e))
+            failed += 1
+            continue
+        if not lic:
+            logger.error("No license available for %s" % sn)
+            failed += 1
+            continue
+        write_license_file(lic, file)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
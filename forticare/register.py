@@ -0,0 +1,703 @@
+# coding: utf-8
+
+"""
+Register a product entitlement or license.
+
+In the case of a license, it can retrieve its license file.
+
+Registrations can also be read from CSV files in the register.sh format, they
+are then streamed one row at a time so that memory does not depend on the
+number of rows. A scheduler reorders a bounded window of rows so that
+licenses, urgent and high priority rows are registered first.
+"""
+
+import configparser
+import csv
+import heapq
+import itertools
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from optparse import OptionParser
+
+from forticare import tracing
+from forticare.utils import check_reply, get_prog, init_logging
+
+# Global
+logger = logging.getLogger(__name__)
+
+# Default priorities of the CSV rows, the highest priority is registered first:
+# a VM waits for its license to boot licensed, a service entitlement can wait
+license_priority = 1
+product_priority = 0
+
+
+class Registration:
+    """
+    A registration read from a CSV row.
+
+    It has the same attributes as the options returned by init_option_parser()
+    so that it can be given to the build_payload_*() and register_*() functions.
+    The deadline is a POSIX timestamp, or None.
+    """
+
+    __slots__ = ("code", "ip", "desc", "sn", "lic", "priority", "deadline")
+
+    def __init__(
+        self, code, ip="", desc="", sn="", lic=False, priority=None, deadline=None
+    ):
+        self.code = code
+        self.ip = ip
+        self.desc = desc
+        self.sn = sn
+        self.lic = lic
+        if priority is None:
+            priority = product_priority if is_product(self) else license_priority
+        self.priority = priority
+        self.deadline = deadline
+
+
+class Scheduler:
+    """
+    Reorder a stream of registrations by priority, deadline and fair share.
+
+    Up to "window" registrations are read ahead from the stream. The next
+    registration is taken from the highest priority present in the window:
+    registrations with a deadline first, earliest deadline first, then the
+    others in turn for each description (ie. customer), so that a large batch
+    for one customer does not delay the other ones.
+
+    The scheduler can be iterated from several threads.
+    """
+
+    def __init__(self, registrations, window=10000):
+        self.registrations = iter(registrations)
+        self.window = window
+        self.size = 0
+        # priority -> (deadline heap, {description: deque of registrations})
+        self.classes = {}
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    def _fill(self):
+        """Read registrations from the stream until the window is full."""
+        while self.size < self.window:
+            registration = next(self.registrations, None)
+            if registration is None:
+                return
+
+            deadlines, groups = self.classes.setdefault(registration.priority, ([], {}))
+            if registration.deadline is not None:
+                heapq.heappush(
+                    deadlines, (registration.deadline, next(self.order), registration)
+                )
+            else:
+                groups.setdefault(registration.desc, deque()).append(registration)
+            self.size += 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            self._fill()
+            if not self.classes:
+                raise StopIteration
+
+            priority = max(self.classes)
+            deadlines, groups = self.classes[priority]
+            if deadlines:
+                registration = heapq.heappop(deadlines)[2]
+            else:
+                # Round robin: serve the first group, then move it last
+                desc = next(iter(groups))
+                queue = groups.pop(desc)
+                registration = queue.popleft()
+                if queue:
+                    groups[desc] = queue
+
+            if not deadlines and not groups:
+                del self.classes[priority]
+            self.size -= 1
+
+            return registration
+
+
+def init_forticare(file=".forticare"):
+    """
+    Initialize code with both the forticare url and token retrieved from a config file.
+
+    Parameters
+    ----------
+    file: str
+        the config file in INI format (default to .forticare)
+
+    Returns
+    -------
+    forticare_url: str
+        the FortiCare url.
+    forticare_token: str
+        the FortiCare token.
+    """
+    config = configparser.ConfigParser()
+    config.read(file)
+    section = "forticare"
+
+    try:
+        forticare_url = config[section]["url"]
+        forticare_token = config[section]["token"]
+    except KeyError as k:
+        logger.error('Missing key {} in configuration file "{}"'.format(k, file))
+        # Non-zero, so that the queue workers don't mark the job as done
+        sys.exit(1)
+
+    logger.debug(f"FortiCare URL: {forticare_url}, FortiCare Token: {forticare_token}")
+
+    return forticare_url, forticare_token
+
+
+def build_payload_product(options):
+    """
+    Build the JSON payload for a product entitlement.
+
+    Parameters
+    ----------
+    options: dict
+        Dictionnary as returned by the optparser module.
+
+    Returns
+    -------
+    json_payload: dict
+        A JSON payload to be used in the API call.
+    """
+    if options.ip is None:
+        options.ip = ""
+        logger.debug("No IP address specified, set payload with an empty string.")
+
+    if options.sn is None:
+        options.sn = ""
+        logger.debug("No Serial number specified, set payload with an empty string.")
+
+    with tracing.span("payload_build", code=options.code):
+        json_payload = {
+            "Token": forticare_token,
+            "Version": "1.0",
+            "RegistrationUnits": [
+                {
+                    "Serial_Number": options.sn,
+                    "Contract_Number": options.code,
+                    "Additional_Info": options.ip,
+                    "Is_Government": False,
+                }
+            ],
+        }
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Payload to post is:")
+        logger.debug(json.dumps(json_payload, indent=4))
+    return json_payload
+
+
+def build_payload_license(options):
+    """
+    Build the JSON payload for a product license.
+
+    Parameters
+    ----------
+    options: dict
+        Dictionnary as returned by the optparser module.
+
+    Returns
+    -------
+    json_payload: dict
+        A JSON payload to be used in the API call.
+    """
+    if options.ip is None:
+        options.ip = ""
+        logger.debug("No IP address specified, set payload it with an empty string.")
+
+    if options.sn is None:
+        options.sn = ""
+        logger.debug("No Serial number specified, set payload with an empty string.")
+
+    with tracing.span("payload_build", code=options.code):
+        json_payload = {
+            "Token": forticare_token,
+            "Version": "1.0",
+            "Serial_Number": options.sn,
+            "License_Registration_Code": options.code,
+            "Description": options.desc,
+            "Additional_Info": options.ip,
+            "Is_Government": False,
+        }
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Payload to post is:")
+        logger.debug(json.dumps(json_payload, indent=4))
+    return json_payload
+
+
+def do_register(api_function, payload):
+    """
+    Perform the API call as per the function and payload given in arguments.
+
+    Parameters
+    ----------
+        api_function: str
+            the API methode to call.
+        payload:
+            the JSON payload to pass to the call.
+
+    Returns
+    -------
+        r.json: dict
+            the content of the API call response in JSON format.
+    """
+    import requests
+
+    url = forticare_url + "/" + api_function
+    with tracing.span("http_call", api_function=api_function):
+        r = requests.post(url=url, json=payload)
+    with tracing.span("json_decode"):
+        jres = r.json()
+    logger.debug('Registration operation terminated with "%s"' % jres["Message"])
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("JSON output is:")
+        logger.debug(json.dumps(jres, indent=4))
+
+    # Raise an APIError (a ValueError) if the registration failed
+    return check_reply(jres)
+
+
+def init_option_parser(argv=None, prog=None):
+    """
+    Initialize an option parser object.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+
+    Returns
+    -------
+        (options,args): tuple
+            A tuple as returned by the optparse module.
+    """
+    global options, args
+
+    usage = (
+        "usage: %prog -c|--code REGCODE | -f|--file CSVFILE [ -f|--file CSVFILE ... ]"
+        "[ -d|--description DESCRIPTION ]"
+        "[ -a|--address IPADDRESS ] [ -s|--serial SERIAL ]"
+        "[ -l|--lic ] [ -n|--workers WORKERS ] [ --window ROWS ] [ -v|--verbose ]"
+        "[ --trace FILENAME ] [ --profile FILENAME ]"
+    )
+
+    parser = OptionParser(usage=usage, prog=get_prog(prog))
+
+    parser.add_option(
+        "-c",
+        "--code",
+        dest="code",
+        metavar="REGCODE",
+        help="Registration code.",
+    )
+    parser.add_option(
+        "-f",
+        "--file",
+        dest="files",
+        action="append",
+        metavar="CSVFILE",
+        help=(
+            "Register the codes of a CSV file in the register.sh format, "
+            "- for stdin (can be repeated)."
+        ),
+    )
+    parser.add_option(
+        "-a",
+        "--address",
+        dest="ip",
+        metavar="IPADDRESS",
+        help="Managemen IP Address if required.",
+    )
+    parser.add_option(
+        "-d",
+        "--description",
+        dest="desc",
+        metavar="DESCRIPTION",
+        help="Description field.",
+    )
+    parser.add_option(
+        "-s",
+        "--serial",
+        dest="sn",
+        metavar="SERIAL",
+        help="Serial number associated with the registration code.",
+    )
+    parser.add_option(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        default=False,
+        help="Verbose output",
+    )
+    parser.add_option(
+        "-l",
+        "--lic",
+        dest="lic",
+        action="store_true",
+        default=False,
+        help=(
+            "Retrieve the license file during the registration"
+            "(filename is <SERIALNUMBER>.lic)."
+        ),
+    )
+    parser.add_option(
+        "-n",
+        "--workers",
+        dest="workers",
+        type="int",
+        default=1,
+        metavar="WORKERS",
+        help=(
+            "With --file, number of registrations run in parallel "
+            "(default: %default)."
+        ),
+    )
+    parser.add_option(
+        "--window",
+        dest="window",
+        type="int",
+        default=10000,
+        metavar="ROWS",
+        help=(
+            "With --file, number of rows read ahead and reordered by priority, "
+            "deadline and description (default: %default)."
+        ),
+    )
+    parser.add_option(
+        "--trace",
+        dest="trace",
+        metavar="FILENAME",
+        help="Write a Chrome trace (JSON) of the run stages to FILENAME.",
+    )
+    parser.add_option(
+        "--profile",
+        dest="profile",
+        metavar="FILENAME",
+        help="Write a cProfile dump of the run to FILENAME.",
+    )
+    (options, args) = parser.parse_args(argv)
+
+    #    if options.desc is None:
+    #        parser.error('Description not specified.')
+
+    if options.code is None and options.files is None:
+        parser.error("Registration code not specified.")
+
+    if options.code is not None and options.files is not None:
+        parser.error("Options --code and --file are mutually exclusive.")
+
+
+def write_license_file(lic, file):
+    """
+    Write the content of the license to a file.
+
+    Parameters
+    ----------
+        lic: str
+            The content of the license file.
+        file: str
+            The file name.
+
+    Returns
+    -------
+        None.
+    """
+    logger.debug("Creating output file %s" % file)
+    with tracing.span("file_write", file=file):
+        # Same bytes as written by "license --sync", which compares them
+        f = open(file, "wb")
+        f.write(lic.encode())
+        f.close()
+
+
+def register_product(options):
+    """
+    Register a product entitlement.
+
+    Parameters
+    ----------
+    options: dict
+        Dictionnary as returned by the optparser module.
+
+    Returns
+    -------
+    None
+    """
+    my_payload = build_payload_product(options)
+    api_function = "REST_RegisterUnits"
+    do_register(api_function, my_payload)
+
+
+def register_license(options):
+    """
+    Register a license and retrieve its license depending of the options provided during the script invocation.
+
+    Parameters
+    ----------
+    options: dict
+        Dictionnary as returned by the optparser module.
+
+    Returns
+    -------
+    None
+    """
+    my_payload = build_payload_license(options)
+    api_function = "REST_RegisterLicense"
+    jres = do_register(api_function, my_payload)
+
+    if options.lic:
+        logger.debug("Option --lic specified so license file will be saved.")
+        asset = jres.get("AssetDetails") or {}
+        lic = (asset.get("License") or {}).get("License_File")
+        if not asset.get("Serial_Number") or not lic:
+            raise ValueError("No license file in the reply for code %s" % options.code)
+        file = asset["Serial_Number"] + ".lic"
+        write_license_file(lic, file)
+
+
+def read_registrations(files, lic=False):
+    """
+    Read registrations from CSV files, one row at a time.
+
+    Rows follow the register.sh format: <code>,<ip>,<description>[,<serial>],
+    optionally followed by a priority (integer, the highest is registered first)
+    and a deadline (seconds from now, or an ISO 8601 date). Empty lines and lines
+    starting with "#" (as generate_csv.py outputs) are skipped.
+
+    Parameters
+    ----------
+    files: list
+        the CSV file names, "-" for the standard input.
+    lic: bool
+        whether the license files must be saved during the registrations.
+
+    Returns
+    -------
+    registrations: generator
+        the Registration objects.
+    """
+    start = time.time()
+    for file in files:
+        f = sys.stdin if file == "-" else open(file, newline="")
+        try:
+            reader = csv.reader(f)
+            for row in reader:
+                if not row or row[0].startswith("#"):
+                    continue
+                try:
+                    priority = int(row[4]) if len(row) > 4 and row[4] else None
+                    deadline = parse_deadline(row[5], start) if len(row) > 5 else None
+                except ValueError as e:
+                    logger.error(
+                        "Skipping line %d of %s: %s" % (reader.line_num, file, e)
+                    )
+                    continue
+                yield Registration(
+                    *row[:4], lic=lic, priority=priority, deadline=deadline
+                )
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def parse_deadline(value, start):
+    """
+    Convert the deadline column of a CSV row into a POSIX timestamp.
+
+    Parameters
+    ----------
+    value: str
+        a number of seconds after "start", or an ISO 8601 date.
+    start: float
+        the POSIX timestamp relative deadlines are counted from.
+
+    Returns
+    -------
+    deadline: float
+        the deadline as a POSIX timestamp.
+    None:
+        None if value is empty.
+    """
+    if not value:
+        return None
+
+    try:
+        return start + float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def register(options):
+    """
+    Register a product entitlement or a license.
+
+    Parameters
+    ----------
+    options: dict
+        Dictionnary as returned by the optparser module, or a Registration.
+
+    Returns
+    -------
+    None
+    """
+    if is_product(options):
+        # Register Product
+        register_product(options)
+    else:
+        # Register License
+        register_license(options)
+
+
+def register_all(registrations, workers=1):
+    """
+    Register a stream of registrations, going on when one of them fails.
+
+    Parameters
+    ----------
+    registrations: iterable
+        the Registration objects, consumed lazily.
+    workers: int
+        the number of registrations run in parallel.
+
+    Returns
+    -------
+    (count, failed): (int, int)
+        the number of processed and failed registrations.
+    """
+    import requests
+
+    registrations = iter(registrations)
+    lock = threading.Lock()
+    results = {"count": 0, "failed": 0}
+
+    def run():
+        while True:
+            with lock:
+                registration = next(registrations, None)
+            if registration is None:
+                return
+
+            success = True
+            try:
+                register(registration)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.error(
+                    "Unable to register code %s: %s" % (registration.code, repr(e))
+                )
+                success = False
+            except Exception as e:
+                # Any other error (unexpected reply, license file not written...)
+                # fails this row only, the thread goes on with the batch
+                logger.exception(
+                    "Unable to register code %s: %s" % (registration.code, repr(e))
+                )
+                success = False
+
+            deadline = getattr(registration, "deadline", None)
+            if deadline is not None and time.time() > deadline:
+                logger.warning(
+                    "Registration of code %s finished %.1fs after its deadline."
+                    % (registration.code, time.time() - deadline)
+                )
+
+            with lock:
+                results["count"] += 1
+                if not success:
+                    results["failed"] += 1
+
+    threads = [threading.Thread(target=run) for i in range(max(workers, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results["count"], results["failed"]
+
+
+def is_product(options):
+    """
+    Return whether the code we're using is for a "product" or a "license". If it's for a "product" then it means we're adding a service entitlement. If it's for a "license" then it means we're registering a new FGT, FMG or FAZ VM.
+
+    Parameters
+    ----------
+    options: dict
+        the global dict initialized with function init_option_parser().
+
+    Returns
+    -------
+    True: Boolean
+        the code corresponds to a product.
+    False: Boolean
+        the code corresponds to a license
+    """
+    code = options.code
+    result = re.search("-", code)
+
+    return False if result else True
+
+
+def main(argv=None, prog=None):
+    """
+    Run the "register" command.
+
+    Parameters
+    ----------
+    argv: list
+        the command line arguments, default to sys.argv[1:].
+    prog: str
+        the program name, default to the name of the running script.
+
+    Returns
+    -------
+    None
+    """
+    global forticare_url, forticare_token, logger
+
+    logger = init_logging(prog)
+    init_option_parser(argv, prog)
+    tracing.start(options.trace, options.profile)
+    forticare_url, forticare_token = init_forticare()
+
+    if options.verbose is False:
+        logger.setLevel(logging.INFO)
+
+    if options.files is None:
+        import requests
+
+        try:
+            register(options)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.error("Unable to register code %s: %s" % (options.code, repr(e)))
+            sys.exit(1)
+    else:
+        scheduler = Scheduler(
+            read_registrations(options.files, options.lic), options.window
+        )
+        count, failed = register_all(scheduler, options.workers)
+        logger.info("%d registration(s) processed, %d failed." % (count, failed))
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# coding: utf-8
+
+"""
+Profiling and tracing hooks shared by the command line tools.
+
+Tracing is disabled by default: span() then returns a shared no-op context
+manager so instrumented code pays a single function call per stage.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+# Global
+_events = None
+_origin = 0
+_trace_file = None
+_profiler = None
+_profile_file = None
+
+
+class _NullSpan:
+    """Context manager returned by span() when tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    """Context manager recording one complete ("X") Chrome trace event."""
+
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        # list.append() is atomic, spans may be recorded from worker threads
+        _events.append(
+            {
+                "name": self.name,
+                "cat": "ftnt",
+                "ph": "X",
+                "ts": (self.start - _origin) / 1000,
+                "dur": (end - self.start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": self.args,
+            }
+        )
+        return False
+
+
+def span(name, **args):
+    """
+    Return a context manager timing the stage "name".
+
+    Parameters
+    ----------
+        name: str
+            the stage name (zip_read, page_extract, regex, payload_build,
+            http_call, json_decode, file_write...).
+        args: dict
+            extra key/values stored with the event.
+
+    Returns
+    -------
+        span: context manager
+            a recording span if tracing is enabled, a no-op one otherwise.
+    """
+    if _events is None:
+        return _null_span
+    return _Span(name, args)
+
+
+def start(trace_file=None, profile_file=None):
+    """
+    Enable tracing and/or profiling for the rest of the run.
+
+    Results are written by stop(), which is registered to run at exit so that
+    early termination paths (sys.exit(), parser errors) still flush them.
+
+    Parameters
+    ----------
+        trace_file: str
+            the Chrome trace (JSON) output file, None to disable tracing.
+        profile_file: str
+            the cProfile output file, None to disable profiling.
+    """
+    global _events, _origin, _trace_file, _profiler, _profile_file
+
+    if trace_file:
+        _trace_file = trace_file
+        _origin = time.perf_counter_ns()
+        _events = []
+
+    if profile_file:
+        import cProfile
+
+        _profile_file = profile_file
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+    if trace_file or profile_file:
+        atexit.register(stop)
+
+
+def stop():
+    """Disable tracing and profiling, then write the requested output files."""
+    global _events, _trace_file, _profiler, _profile_file
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_file)
+        _profiler = None
+        _profile_file = None
+
+    if _events is not None:
+        events = _events
+        _events = None
+        trace = {
+            "traceEvents": [
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "args": {"name": os.path.basename(sys.argv[0])},
+                }
+            ]
+            + events,
+            "displayTimeUnit": "ms",
+        }
+        with open(_trace_file, "w") as f:
+            json.dump(trace, f)
+        _trace_file = None
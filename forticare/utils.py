@@ -0,0 +1,100 @@
+# coding: utf-8
+
+"""Helpers shared by the FortiCare tools."""
+
+import logging
+import os
+import sys
+
+
+def get_prog(prog=None):
+    """
+    Return the program name used in usage messages and log lines.
+
+    Parameters
+    ----------
+        prog: str
+            the program name, None to use the name of the running script.
+
+    Returns
+    -------
+        prog: str
+            the program name.
+    """
+    return prog if prog else os.path.basename(sys.argv[0])
+
+
+def init_logging(prog=None):
+    """Initialize and return an Logger object.
+
+    Parameters
+    ----------
+        prog: str
+            the logger name, default to the name of the running script.
+
+    Returns
+    -------
+        logger: logger
+            The logger object.
+    """
+    # create logger
+    logger = logging.getLogger(get_prog(prog))
+    logger.setLevel(logging.DEBUG)
+
+    # the logger may already be initialized when a tool runs another one
+    if logger.handlers:
+        return logger
+
+    # create console handler and set level to debug
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+
+    # create formatter
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    # add formatter to ch
+    ch.setFormatter(formatter)
+
+    # add ch to logger
+    logger.addHandler(ch)
+
+    return logger
+
+
+class APIError(ValueError):
+    """FortiCare reply reporting an error (invalid token, unknown asset...)."""
+
+    pass
+
+
+def check_reply(jres):
+    """
+    Raise an APIError if a FortiCare reply reports an error.
+
+    Parameters
+    ----------
+        jres: dict
+            the content of the API call response in JSON format.
+
+    Returns
+    -------
+        jres: dict
+            the reply, unchanged.
+    """
+    if not isinstance(jres, dict):
+        raise APIError("Unexpected reply: %r" % (jres,))
+
+    # Successful replies have a null "Error" and a "Status" of 0
+    error = jres.get("Error")
+    if error or jres.get("Status", 0) != 0:
+        if isinstance(error, dict):
+            error = error.get("Message") or error
+        raise APIError(
+            'FortiCare returned status {} "{}": {}'.format(
+                jres.get("Status"), jres.get("Message"), error
+            )
+        )
+
+    return jres
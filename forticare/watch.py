@@ -0,0 +1,495 @@
+# coding: utf-8
+
+"""
+Watch an inbox folder and queue the registrations of new order ZIP files.
+
+New ZIP files are detected with inotify on Linux, by polling the folder
+otherwise. Once complete, a ZIP file is classified with get_license_type(), its
+registration codes are extracted and a "register" job is added to the job queue
+for each of them (with the license file retrieval), so that the queue workers
+register them right away.
+
+Service entitlement (FC) archives are not queued: each code must be bound to a
+FortiGate-VM serial number, which can't be chosen safely without an operator.
+They are logged and left for generate_csv.py.
+
+Processed archives are recorded in a state file, so that each archive is only
+processed once across restarts, even if it is renamed. The job identifiers are
+derived from the archive and the codes, so that an archive whose jobs were
+partially queued before a crash is queued again without duplicates.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import os
+import select
+import struct
+import time
+
+from forticare import generate_csv, jobqueue
+from forticare.utils import get_prog, init_logging
+
+# Global
+logger = logging.getLogger(__name__)
+
+
+class Inotify:
+    """Minimal inotify binding reporting the files written or moved in a folder."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        wd = libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno))
+
+    def read(self, timeout):
+        """
+        Wait for events.
+
+        Parameters
+        ----------
+            timeout: float
+                the maximum waiting time in seconds.
+
+        Returns
+        -------
+            names: list
+                the names of the files written or moved in the folder, None if
+                events were lost and the folder must be scanned.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        names = []
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+            offset += struct.calcsize("iIII")
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(name))
+
+        return names
+
+    def close(self):
+        """Release the inotify file descriptor."""
+        os.close(self.fd)
+
+
+class State:
+    """
+    Append-only record of the processed archives.
+
+    Each line is "<sha256> <size> <mtime_ns> <name>". An archive is known if its
+    name, size and modification time are known (no need to read it), or if its
+    content hash is known (same archive under another name).
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.hashes = set()
+        self.stats = set()
+        if os.path.exists(file):
+            with open(file) as f:
+                for line in f:
+                    sha256, size, mtime_ns, name = line.rstrip("\n").split(" ", 3)
+                    self.hashes.add(sha256)
+                    self.stats.add((name, int(size), int(mtime_ns)))
+
+    def is_known(self, name, stat):
+        """
+        Return whether an archive is known without reading it.
+
+        Parameters
+        ----------
+            name: str
+                the archive file name.
+            stat: os.stat_result
+                the archive file status.
+
+        Returns
+        -------
+            known: bool
+                True if the archive has already been processed.
+        """
+        return (name, stat.st_size, stat.st_mtime_ns) in self.stats
+
+    def add(self, sha256, name, stat):
+        """
+        Record a processed archive.
+
+        Parameters
+        ----------
+            sha256: str
+                the archive content hash.
+            name: str
+                the archive file name.
+            stat: os.stat_result
+                the archive file status.
+        """
+        with open(self.file, "a") as f:
+            f.write(
+                "{} {} {} {}\n".format(sha256, stat.st_size, stat.st_mtime_ns, name)
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        self.hashes.add(sha256)
+        self.stats.add((name, stat.st_size, stat.st_mtime_ns))
+
+
+def get_sha256(file):
+    """
+    Return the SHA-256 of a file content.
+
+    Parameters
+    ----------
+        file: str
+            the file name.
+
+    Returns
+    -------
+        sha256: str
+            the hexadecimal digest.
+    """
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def is_complete(file):
+    """
+    Return whether a ZIP file has been completely written.
+
+    Parameters
+    ----------
+        file: str
+            the ZIP file name.
+
+    Returns
+    -------
+        complete: bool
+            True if the ZIP central directory, written last, can be read.
+    """
+    import zipfile
+
+    try:
+        return zipfile.is_zipfile(file)
+    except OSError:
+        return False
+
+
+def get_job_id(sha256, stat, code):
+    """
+    Return the job identifier of a registration code of an archive.
+
+    Parameters
+    ----------
+        sha256: str
+            the archive content hash.
+        stat: os.stat_result
+            the archive file status.
+        code: str
+            the registration code.
+
+    Returns
+    -------
+        job_id: str
+            the job identifier, sorted by archive modification time.
+    """
+    digest = hashlib.sha256((sha256 + code).encode()).hexdigest()
+    return "{:020d}-{}".format(stat.st_mtime_ns, digest[:8])
+
+
+def queue_registrations(store, file, ip, desc, sha256, stat):
+    """
+    Queue the registrations of the codes of an order ZIP file.
+
+    Parameters
+    ----------
+        store: FileStore
+            the job store.
+        file: str
+            the ZIP file name.
+        ip: str
+            the IP address to associate to the licenses.
+        desc: str
+            the description to associate to the licenses.
+        sha256: str
+            the ZIP file content hash.
+        stat: os.stat_result
+            the ZIP file status.
+
+    Returns
+    -------
+        count: int
+            the number of queued registrations, None if the ZIP file can't be
+            processed.
+    """
+    license_type = generate_csv.get_license_type(os.path.basename(file))
+    if license_type not in generate_csv.license_types:
+        logger.warning("Unknown license type: ignoring %s" % file)
+        return 0
+
+    license_type_string = generate_csv.license_types[license_type]
+    logger.info("%s is for [%s] license(s)." % (file, license_type_string))
+
+    if license_type == "FC":
+        # Binding the codes to the .lic files of a folder would bind two orders
+        # to the same FortiGate-VMs
+        logger.warning(
+            "%s holds service entitlements, register it manually "
+            "(generate_csv.py -l FOLDER)" % file
+        )
+        return 0
+
+    codes = list(generate_csv.get_registration_codes(file, license_type))
+    if None in codes:
+        logger.error("Registration code not found in some PDF files of %s" % file)
+        return None
+
+    for code in codes:
+        store.put(
+            {
+                "type": "register",
+                "code": code,
+                "ip": ip,
+                "desc": desc,
+                "sn": "",
+                "lic": True,
+            },
+            get_job_id(sha256, stat, code),
+        )
+
+    return len(codes)
+
+
+def process_folder(folder, names, state, store, options, sizes):
+    """
+    Process the complete and unknown ZIP files of a folder.
+
+    Parameters
+    ----------
+        folder: str
+            the inbox folder.
+        names: list
+            the file names to check, None to scan the whole folder.
+        state: State
+            the processed archives.
+        store: FileStore
+            the job store.
+        options: Namespace
+            the parsed arguments.
+        sizes: dict
+            the (size, mtime) of the ZIP files at the previous scan, a file is
+            only processed by a scan once it stopped changing.
+    """
+    scan = names is None
+    if scan:
+        names = os.listdir(folder)
+
+    for name in sorted(names):
+        if not name.lower().endswith(".zip"):
+            continue
+
+        file = os.path.join(folder, name)
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            continue
+        if state.is_known(name, stat):
+            continue
+
+        if scan:
+            previous = sizes.get(name)
+            sizes[name] = (stat.st_size, stat.st_mtime_ns)
+            if previous != sizes[name]:
+                # Still being written, or not seen yet: check at the next scan
+                continue
+        if not is_complete(file):
+            continue
+
+        try:
+            sha256 = get_sha256(file)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            # Unreadable (permissions...), it will be retried at restart
+            logger.error("Unable to read %s: %s" % (name, repr(e)))
+            state.stats.add((name, stat.st_size, stat.st_mtime_ns))
+            continue
+        if sha256 not in state.hashes:
+            desc = options.desc
+            if desc is None:
+                desc = os.path.splitext(name)[0]
+            try:
+                count = queue_registrations(
+                    store, file, options.ip, desc, sha256, stat
+                )
+            except Exception as e:
+                # A corrupted archive must not stop the watcher
+                logger.error("Unable to process %s: %s" % (name, repr(e)))
+                count = None
+            if count is None:
+                # Keep the archive unprocessed, it will be retried at restart
+                state.stats.add((name, stat.st_size, stat.st_mtime_ns))
+                continue
+            logger.info("%d registration(s) of %s queued." % (count, name))
+        else:
+            logger.info("%s has already been processed under another name." % name)
+
+        state.add(sha256, name, stat)
+
+
+def parse_command_line_arguments(argv=None, prog=None):
+    """
+    Commande line management with an argparse instance.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+
+    Returns
+    -------
+        args: Namespace
+            the parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog=get_prog(prog))
+    parser.add_argument(
+        "-w",
+        "--watch",
+        dest="folder",
+        required=True,
+        help="Indicate the inbox folder where the order ZIP files land",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        dest="queue",
+        required=True,
+        help="Indicate the job queue directory (see the queue command)",
+    )
+    parser.add_argument(
+        "-d",
+        "--desc",
+        dest="desc",
+        default=None,
+        help="Indicate a description (default: the ZIP file name)",
+    )
+    parser.add_argument(
+        "-i",
+        "--ip",
+        dest="ip",
+        default="",
+        help="Indicate the license IP address (default: none)",
+    )
+    parser.add_argument(
+        "--state",
+        dest="state",
+        default=None,
+        help="File recording the processed ZIP files (default: FOLDER/.processed)",
+    )
+    parser.add_argument(
+        "--poll",
+        dest="poll",
+        type=float,
+        default=2.0,
+        help="Folder scan interval in seconds (default: 2)",
+    )
+    parser.add_argument(
+        "--no-inotify",
+        dest="inotify",
+        action="store_false",
+        default=True,
+        help="Poll the folder even if inotify is available",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        default=False,
+        help="Verbose output",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None, prog=None):
+    """
+    Run the "watch" command.
+
+    Parameters
+    ----------
+        argv: list
+            the command line arguments, default to sys.argv[1:].
+        prog: str
+            the program name, default to the name of the running script.
+    """
+    global logger
+
+    logger = init_logging(prog)
+    options = parse_command_line_arguments(argv, prog)
+
+    if options.verbose is False:
+        logger.setLevel(logging.INFO)
+
+    store = jobqueue.FileStore(options.queue)
+    state = State(options.state or os.path.join(options.folder, ".processed"))
+
+    inotify = None
+    if options.inotify:
+        try:
+            inotify = Inotify(options.folder)
+        except (AttributeError, OSError) as e:
+            # Not Linux, or inotify limits reached
+            logger.warning("inotify unavailable (%s), polling %s" % (e, options.folder))
+    logger.info("Watching %s" % options.folder)
+
+    sizes = {}
+    try:
+        # The archives which landed while we were down are processed by the
+        # second scan, once they are known not to be still written
+        process_folder(options.folder, None, state, store, options, sizes)
+        while True:
+            names = None
+            if inotify is None:
+                time.sleep(options.poll)
+            else:
+                names = inotify.read(options.poll)
+                if names == []:
+                    # Nothing happened, scan in case an event has been missed
+                    names = None
+            process_folder(options.folder, names, state, store, options, sizes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+# coding: utf-8
+
+"""
+Persistent job queue for registrations and license downloads.
+
+Kept for compatibility, same as "python3 -m forticare queue".
+"""
+
+from forticare.jobqueue import main
+
+if __name__ == "__main__":
+    main()
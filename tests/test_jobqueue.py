@@ -0,0 +1,118 @@
+# coding: utf-8
+
+"""Tests of the file-backed job store of forticare.jobqueue."""
+
+import os
+import threading
+import time
+from collections import deque
+
+from forticare import jobqueue
+
+
+def test_put_and_claim(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path))
+    job_id = store.put({"type": "download", "sn": "FGVM01"})
+
+    lease, job = store.claim("worker")
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+    assert job["worker"] == "worker"
+    assert store.claim("worker") is None
+
+    assert store.release(lease, job, "done")
+    assert store.counts() == {"pending": 0, "leased": 0, "done": 1, "failed": 0}
+
+
+def test_claimers_racing_for_one_job(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path))
+    store.put({"type": "download", "sn": "FGVM01"})
+
+    # Both workers listed the job before any of them claimed it
+    first, second = deque(store.list_pending()), deque(store.list_pending())
+    assert store.claim("first", first) is not None
+    assert store.claim("second", second) is None
+    assert store.counts()["leased"] == 1
+
+
+def test_threads_claim_each_job_once(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path))
+    for i in range(200):
+        store.put({"type": "download", "sn": "FGVM%03d" % i})
+
+    claimed = []
+    barrier = threading.Barrier(8)
+
+    def run(worker):
+        pending = deque()
+        barrier.wait()
+        while True:
+            result = store.claim(worker, pending)
+            if result is None:
+                return
+            claimed.append(result[1]["sn"])
+
+    threads = [threading.Thread(target=run, args=(str(i),)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == ["FGVM%03d" % i for i in range(200)]
+
+
+def expire(lease):
+    """Make a lease look older than any lease duration."""
+    past = time.time() - 3600
+    os.utime(lease, (past, past))
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path), lease=60.0)
+    store.put({"type": "download", "sn": "FGVM01"})
+    lease, job = store.claim("first")
+
+    # A renewed lease is not expired
+    assert store.renew(lease)
+    assert store.requeue_expired() == 0
+
+    expire(lease)
+    assert store.requeue_expired() == 1
+    assert store.counts() == {"pending": 1, "leased": 0, "done": 0, "failed": 0}
+    assert not store.renew(lease)
+
+    lease, job = store.claim("second")
+    assert job["attempts"] == 2
+    assert job["worker"] == "second"
+
+
+def test_release_after_lost_lease(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path), lease=60.0)
+    store.put({"type": "download", "sn": "FGVM01"})
+    lost_lease, lost_job = store.claim("first")
+    expire(lost_lease)
+    store.requeue_expired()
+
+    # The job stays pending, as re-queued
+    assert not store.release(lost_lease, lost_job, "done")
+    assert store.counts() == {"pending": 1, "leased": 0, "done": 0, "failed": 0}
+
+    # and can't be completed by the first worker once claimed again
+    lease, job = store.claim("second")
+    assert not store.release(lost_lease, lost_job, "done")
+    assert store.counts()["leased"] == 1
+    assert store.release(lease, job, "done")
+    assert store.counts() == {"pending": 0, "leased": 0, "done": 1, "failed": 0}
+
+
+def test_put_with_job_id_is_idempotent(tmp_path):
+    store = jobqueue.FileStore(str(tmp_path))
+    job_id = "{:020d}-{}".format(1, "0123abcd")
+    assert store.put({"type": "download", "sn": "FGVM01"}, job_id) == job_id
+
+    # whatever the state of the job
+    lease, job = store.claim("worker")
+    store.put({"type": "download", "sn": "FGVM01"}, job_id)
+    store.release(lease, job, "done")
+    store.put({"type": "download", "sn": "FGVM01"}, job_id)
+    assert store.counts() == {"pending": 0, "leased": 0, "done": 1, "failed": 0}